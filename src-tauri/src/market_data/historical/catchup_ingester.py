@@ -7,19 +7,21 @@ It uses Dukascopy as the historical data source for forex pairs.
 
 Major improvements:
 - Concurrent downloads (25 workers by default)
-- Batched database inserts (1M ticks per batch)
+- Batched database inserts (10k ticks per batch)
 - Progress reporting in JSON format
 - Memory-efficient processing
 - Exponential backoff for retries
+- Cascade aggregate refresh in a detached background process
 
 Usage:
     python3 catchup_ingester.py --symbol EURUSD --from "2024-01-15T10:30:00Z" --to "2024-01-15T11:00:00Z"
 """
 
 import argparse
+import asyncio
+import io
 import lzma
-import struct
-import requests
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta, timezone
 import logging
@@ -28,13 +30,15 @@ import os
 import json
 import time
 import psutil
+import urllib3
 from typing import List, Dict, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from threading import Lock, Thread
 from queue import Queue
 import signal
+import subprocess
+import tempfile
 from sqlalchemy import create_engine, text
-from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
 # Set up logging
@@ -45,6 +49,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Dukascopy bi5 record layout: big-endian ms offset, ask/bid as scaled ints, ask/bid volumes
+BI5_DTYPE = np.dtype([
+    ('ts', '>u4'),
+    ('ask', '>u4'),
+    ('bid', '>u4'),
+    ('av', '>f4'),
+    ('bv', '>f4'),
+])
+
+# Detached --refresh-only processes append their stderr here so failed refreshes can be diagnosed
+REFRESH_LOG_PATH = os.path.join(tempfile.gettempdir(), 'catchup_refresh.log')
+
+# HTTP statuses worth retrying with exponential backoff
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+# Column order used when staging ticks into the temp table; symbol and source are
+# constant per catchup and bound on the upsert instead
+TICK_COLUMNS = ['time', 'bid', 'ask', 'bid_size', 'ask_size']
+TICK_SOURCE = 'dukascopy'
+
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def epoch_ms(dt: datetime, round_up: bool = False) -> int:
+    """Convert a tz-aware datetime to integer milliseconds since the Unix epoch"""
+    us = (dt - UNIX_EPOCH) // timedelta(microseconds=1)
+    return -(-us // 1000) if round_up else us // 1000
+
 
 class ProgressReporter:
     """Thread-safe progress reporter that outputs JSON to stdout"""
@@ -58,48 +90,88 @@ class ProgressReporter:
         self.lock = Lock()
         self.start_time = time.time()
         
+        # Memory is sampled at most once per second; each sample is a syscall
+        self._process = psutil.Process()
+        self._last_mem_sample = 0.0
+        self._last_mem_mb = 0.0
+        
+        # Progress lines are emitted at most 5 times per second; any update held back by
+        # the limit is flushed by final_report so the last progress line is always exact
+        self._last_emit = 0.0
+        self._pending_emit = False
+        self._emit_lock = Lock()
+        
     def update(self, hours: int = 0, ticks: int = 0, failed_hour: Optional[str] = None):
+        # Only the counter updates and the emit decision happen under the lock
         with self.lock:
             self.hours_completed += hours
             self.ticks_processed += ticks
             if failed_hour:
                 self.failed_hours.append(failed_hour)
             
-            # Calculate metrics
-            elapsed = time.time() - self.start_time
-            progress_pct = (self.hours_completed / self.total_hours * 100) if self.total_hours > 0 else 0
-            ticks_per_sec = self.ticks_processed / elapsed if elapsed > 0 else 0
-            eta_seconds = ((self.total_hours - self.hours_completed) / self.hours_completed * elapsed) if self.hours_completed > 0 else 0
-            
-            # Memory usage
-            process = psutil.Process()
-            memory_mb = process.memory_info().rss / 1024 / 1024
+            now = time.time()
+            if now - self._last_emit < 0.2 and self.hours_completed < self.total_hours:
+                self._pending_emit = True
+                return
+            self._last_emit = now
+            self._pending_emit = False
             
-            # Output progress as JSON line
-            progress = {
-                "type": "progress",
-                "current_hour": self.hours_completed,
-                "total_hours": self.total_hours,
-                "progress_pct": round(progress_pct, 1),
-                "ticks_processed": self.ticks_processed,
-                "ticks_per_second": round(ticks_per_sec),
-                "memory_mb": round(memory_mb),
-                "eta_seconds": round(eta_seconds),
-                "failed_hours": len(self.failed_hours)
-            }
-            print(json.dumps(progress), flush=True)
+            hours_completed = self.hours_completed
+            ticks_processed = self.ticks_processed
+            failed_count = len(self.failed_hours)
+        
+        self._emit_progress(now, hours_completed, ticks_processed, failed_count)
     
-    def final_report(self, ticks_inserted: int):
+    def _emit_progress(self, now: float, hours_completed: int, ticks_processed: int, failed_count: int):
+        # Calculate metrics from the snapshot
+        elapsed = now - self.start_time
+        progress_pct = (hours_completed / self.total_hours * 100) if self.total_hours > 0 else 0
+        ticks_per_sec = ticks_processed / elapsed if elapsed > 0 else 0
+        eta_seconds = ((self.total_hours - hours_completed) / hours_completed * elapsed) if hours_completed > 0 else 0
+        
+        # Memory usage
+        if now - self._last_mem_sample > 1.0:
+            self._last_mem_mb = self._process.memory_info().rss / 1024 / 1024
+            self._last_mem_sample = now
+        
+        # Output progress as JSON line
+        progress = {
+            "type": "progress",
+            "current_hour": hours_completed,
+            "total_hours": self.total_hours,
+            "progress_pct": round(progress_pct, 1),
+            "ticks_processed": ticks_processed,
+            "ticks_per_second": round(ticks_per_sec),
+            "memory_mb": round(self._last_mem_mb),
+            "eta_seconds": round(eta_seconds),
+            "failed_hours": failed_count
+        }
+        line = json.dumps(progress)
+        with self._emit_lock:
+            print(line, flush=True)
+    
+    def final_report(self, ticks_inserted: int, failed_batches: int = 0):
+        # Emit the progress line the rate limit may have held back
+        with self.lock:
+            pending = self._pending_emit
+            self._pending_emit = False
+            hours_completed = self.hours_completed
+            ticks_processed = self.ticks_processed
+            failed_count = len(self.failed_hours)
+        if pending:
+            self._emit_progress(time.time(), hours_completed, ticks_processed, failed_count)
+        
         self.ticks_inserted = ticks_inserted
         elapsed = time.time() - self.start_time
         
         report = {
             "type": "complete",
-            "status": "success" if not self.failed_hours else "partial",
+            "status": "success" if not self.failed_hours and not failed_batches else "partial",
             "ticks_inserted": ticks_inserted,
             "ticks_processed": self.ticks_processed,
             "hours_processed": self.hours_completed,
             "hours_failed": len(self.failed_hours),
+            "batches_failed": failed_batches,
             "elapsed_seconds": round(elapsed, 2),
             "ticks_per_second": round(self.ticks_processed / elapsed) if elapsed > 0 else 0
         }
@@ -107,7 +179,13 @@ class ProgressReporter:
 
 
 class CatchupIngester:
-    def __init__(self, db_url: str = None, max_workers: int = 25, batch_size: int = 1_000_000):
+    # HTTP pool shared by every ingester in the process so pooled connections are reused
+    _http: Optional[urllib3.PoolManager] = None
+    _http_maxsize = 0
+    _http_lock = Lock()
+    
+    def __init__(self, db_url: str = None, max_workers: int = 25, batch_size: int = 10_000,
+                 db_writers: int = 4, http2: bool = False):
         """
         Initialize the catchup ingester
         
@@ -115,161 +193,186 @@ class CatchupIngester:
             db_url: Database connection string
             max_workers: Number of concurrent download workers
             batch_size: Number of ticks to insert per batch
+            db_writers: Number of concurrent database writer threads
+            http2: If True, download over multiplexed HTTP/2 with httpx instead of urllib3
         """
         self.base_url = "https://datafeed.dukascopy.com/datafeed"
         self.max_workers = max_workers
         self.batch_size = batch_size
+        self.db_writers = max(1, db_writers)
+        self.http2 = http2
         
         # Use environment variable if db_url not provided
         if not db_url:
             db_url = os.getenv('DATABASE_URL', 'postgresql://postgres@localhost:5432/forex_trading')
         
+        # insert_batch COPYs through psycopg2's copy_expert, so pin that driver; SQLAlchemy
+        # 2.1+ resolves a bare postgresql:// URL to psycopg 3, which has no copy_expert
+        for scheme in ('postgresql://', 'postgres://'):
+            if db_url.startswith(scheme):
+                db_url = 'postgresql+psycopg2://' + db_url[len(scheme):]
+                break
+        
+        self.db_url = db_url
         self.engine = create_engine(db_url, pool_size=10, max_overflow=20)
         self.logger = logging.getLogger(__name__)
         
-        # Setup session with retry strategy
-        self.session = requests.Session()
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-        )
-        adapter = HTTPAdapter(
-            max_retries=retry_strategy,
-            pool_connections=max_workers,
-            pool_maxsize=max_workers
-        )
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+        self.http = self._get_http(max_workers)
         
         # For graceful shutdown
         self.shutdown = False
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
     
+    @classmethod
+    def _get_http(cls, max_workers: int) -> urllib3.PoolManager:
+        """
+        Return the process-wide urllib3 pool, creating it with a retry strategy on first use
+        
+        The pool blocks when full, so it is recreated whenever an ingester needs more
+        connections than it holds; instances created earlier keep using the old pool
+        """
+        maxsize = max(max_workers, 25)
+        with cls._http_lock:
+            if cls._http is None or maxsize > cls._http_maxsize:
+                retry_strategy = Retry(
+                    total=3,
+                    backoff_factor=1,
+                    status_forcelist=RETRY_STATUSES,
+                )
+                # All downloads hit a single origin; block when every pooled connection is
+                # busy instead of opening and discarding extra sockets ("Connection pool is full")
+                cls._http = urllib3.PoolManager(
+                    num_pools=1,
+                    maxsize=maxsize,
+                    block=True,
+                    retries=retry_strategy,
+                    headers={'Connection': 'keep-alive'}
+                )
+                cls._http_maxsize = maxsize
+            return cls._http
+    
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals gracefully"""
         self.logger.info(f"Received signal {signum}, shutting down gracefully...")
         self.shutdown = True
         
-    def download_bi5_file(self, symbol: str, date: datetime, hour: Optional[int] = None, 
-                          daily: bool = False) -> Tuple[Optional[bytes], datetime, Optional[int]]:
+    def download_bi5_file(self, url: str, date: datetime,
+                          hour: Optional[int] = None) -> Tuple[Optional[bytes], datetime, Optional[int]]:
         """
-        Download compressed bi5 file for specific hour or full day
+        Download a bi5 file for specific hour or full day, decompressing it as it streams in
         
         Args:
-            symbol: Trading symbol
+            url: Fully-formed file URL, built when downloads are planned
             date: Date to fetch
             hour: Hour to fetch (None for daily)
-            daily: If True, fetch daily file
         
         Returns:
-            Tuple of (data, date, hour) to maintain context through concurrent execution
+            Tuple of (decompressed data, date, hour) to maintain context through concurrent execution
         """
         if self.shutdown:
             return None, date, hour
-            
-        if daily:
-            # Daily file: /{year}/{month-1}/{day}_ticks.bi5 (discovered pattern)
-            url = f"{self.base_url}/{symbol.upper()}/{date.year}/{date.month-1:02d}/{date.day:02d}_ticks.bi5"
-            timeframe = "daily"
-        else:
-            # Hourly file: /{year}/{month-1}/{day}/{hour}h_ticks.bi5
-            url = f"{self.base_url}/{symbol.upper()}/{date.year}/{date.month-1:02d}/{date.day:02d}/{hour:02d}h_ticks.bi5"
-            timeframe = "hourly"
         
         try:
-            response = self.session.get(url, timeout=30)
-            if response.status_code == 404:
-                self.logger.debug(f"No data available for {symbol} at {date.date()} {f'{hour:02d}:00' if hour is not None else 'daily'}")
-                return None, date, hour
-            response.raise_for_status()
-            return response.content, date, hour
-        except requests.RequestException as e:
+            response = self.http.request('GET', url, preload_content=False, timeout=30.0)
+            try:
+                if response.status == 404:
+                    self.logger.debug(f"No data available at {date.date()} {f'{hour:02d}:00' if hour is not None else 'daily'}: {url}")
+                    response.drain_conn()
+                    return None, date, hour
+                if response.status >= 400:
+                    self.logger.error(f"Failed to download {url}: HTTP {response.status}")
+                    response.drain_conn()
+                    return None, date, hour
+                
+                # Decompress LZMA data while the body is still arriving
+                decompressor = lzma.LZMADecompressor()
+                parts = []
+                received = 0
+                for chunk in response.stream(1 << 16):
+                    received += len(chunk)
+                    parts.append(decompressor.decompress(chunk))
+                
+                # A cut-off body decodes to a shorter prefix without raising, so require end of stream
+                if received and not decompressor.eof:
+                    self.logger.error(f"Failed to decompress {url}: truncated LZMA stream")
+                    return None, date, hour
+                return b''.join(parts), date, hour
+            finally:
+                response.release_conn()
+        except urllib3.exceptions.HTTPError as e:
             self.logger.error(f"Failed to download {url}: {e}")
             return None, date, hour
+        except lzma.LZMAError as e:
+            self.logger.error(f"Failed to decompress {url}: {e}")
+            return None, date, hour
     
-    def parse_bi5_data(self, compressed_data: bytes, symbol: str, base_time: datetime) -> List[Dict]:
-        """Parse compressed bi5 data into tick records"""
-        if not compressed_data:
-            return []
+    def parse_bi5_data(self, decompressed: bytes, symbol: str, base_time: datetime) -> pd.DataFrame:
+        """Parse decompressed bi5 data into a DataFrame of tick records with epoch-ms times"""
+        if not decompressed:
+            return pd.DataFrame()
             
         try:
-            # Decompress LZMA data
-            decompressed = lzma.decompress(compressed_data)
+            # Decode all 20-byte records at once, ignoring any trailing partial record
+            count = len(decompressed) // BI5_DTYPE.itemsize
+            arr = np.frombuffer(decompressed, dtype=BI5_DTYPE, count=count)
             
-            # Parse binary records (each record is 20 bytes)
-            chunk_size = struct.calcsize('>3I2f')
-            ticks = []
+            # Convert to actual prices (Dukascopy uses integer representation)
+            # JPY pairs use 3 decimal places, others use 5
+            scale = 1000.0 if 'JPY' in symbol.upper() else 100000.0
             
-            for i in range(0, len(decompressed), chunk_size):
-                if i + chunk_size > len(decompressed):
-                    break
-                    
-                chunk = decompressed[i:i + chunk_size]
-                timestamp_ms, ask_raw, bid_raw, ask_vol, bid_vol = struct.unpack('>3I2f', chunk)
-                
-                # Convert to actual prices (Dukascopy uses integer representation)
-                # JPY pairs use 3 decimal places, others use 5
-                if 'JPY' in symbol.upper():
-                    ask_price = ask_raw / 1000.0
-                    bid_price = bid_raw / 1000.0
-                else:
-                    ask_price = ask_raw / 100000.0
-                    bid_price = bid_raw / 100000.0
-                
-                # Calculate actual timestamp
-                tick_time = base_time + timedelta(milliseconds=timestamp_ms)
-                
-                ticks.append({
-                    'time': tick_time,
-                    'symbol': symbol,
-                    'ask': ask_price,
-                    'bid': bid_price,
-                    'ask_size': int(ask_vol * 1000000),
-                    'bid_size': int(bid_vol * 1000000),
-                    'source': 'dukascopy'
-                })
+            # Calculate actual timestamps as int64 epoch milliseconds
+            times = epoch_ms(base_time) + arr['ts'].astype(np.int64)
             
-            return ticks
+            return pd.DataFrame({
+                'time': times,
+                'ask': arr['ask'] / scale,
+                'bid': arr['bid'] / scale,
+                'ask_size': (arr['av'].astype(np.float64) * 1000000).astype(np.int64),
+                'bid_size': (arr['bv'].astype(np.float64) * 1000000).astype(np.int64)
+            })
         except Exception as e:
             self.logger.error(f"Error parsing bi5 data: {e}")
-            return []
+            return pd.DataFrame()
     
-    def insert_batch(self, ticks: List[Dict]) -> int:
+    def insert_batch(self, df: pd.DataFrame, symbol: str) -> int:
         """
-        Insert a batch of ticks into the database
+        Insert a batch of ticks for one symbol into the database
         
         Returns:
             Number of ticks inserted
         """
-        if not ticks:
+        if df.empty:
             return 0
             
         try:
-            df = pd.DataFrame(ticks)
-            
             with self.engine.begin() as conn:
                 # Create temp table for this batch
                 conn.execute(text("""
                     CREATE TEMP TABLE temp_catchup_ticks (
-                        time TIMESTAMPTZ NOT NULL,
-                        symbol VARCHAR(10) NOT NULL,
-                        bid DECIMAL(10,5) NOT NULL,
-                        ask DECIMAL(10,5) NOT NULL,
+                        time BIGINT NOT NULL,
+                        bid DOUBLE PRECISION NOT NULL,
+                        ask DOUBLE PRECISION NOT NULL,
                         bid_size INTEGER DEFAULT 0,
-                        ask_size INTEGER DEFAULT 0,
-                        source VARCHAR(20) DEFAULT 'dukascopy'
+                        ask_size INTEGER DEFAULT 0
                     ) ON COMMIT DROP
                 """))
                 
-                # Bulk insert into temp table
-                df.to_sql('temp_catchup_ticks', conn, if_exists='append', index=False, method='multi')
+                # Bulk load into temp table via COPY on the underlying psycopg2 connection
+                buf = io.StringIO()
+                df.to_csv(buf, columns=TICK_COLUMNS, index=False, header=False)
+                buf.seek(0)
+                with conn.connection.dbapi_connection.cursor() as cur:
+                    cur.copy_expert(
+                        f"COPY temp_catchup_ticks ({', '.join(TICK_COLUMNS)}) FROM STDIN WITH CSV",
+                        buf
+                    )
                 
-                # Upsert from temp table to main table
+                # Upsert from temp table to main table, converting epoch-ms times exactly
                 result = conn.execute(text("""
                     INSERT INTO forex_ticks (time, symbol, bid, ask, bid_size, ask_size, source)
-                    SELECT time, symbol, bid, ask, bid_size, ask_size, source 
+                    SELECT TIMESTAMPTZ 'epoch' + time * INTERVAL '1 millisecond',
+                           :symbol, bid, ask, bid_size, ask_size, :source
                     FROM temp_catchup_ticks
                     ON CONFLICT (symbol, time) 
                     DO UPDATE SET 
@@ -278,24 +381,251 @@ class CatchupIngester:
                         bid_size = EXCLUDED.bid_size,
                         ask_size = EXCLUDED.ask_size,
                         source = EXCLUDED.source
-                    RETURNING 1
-                """))
+                """), {'symbol': symbol, 'source': TICK_SOURCE})
                 
+                # rowcount comes from the INSERT command tag (inserted + updated rows)
                 return result.rowcount
                 
         except Exception as e:
-            self.logger.error(f"Failed to insert batch of {len(ticks)} ticks: {e}")
+            self.logger.error(f"Failed to insert batch of {len(df)} ticks: {e}")
             raise
     
+    def _flush_chunks(self, chunks: List[pd.DataFrame], symbol: str) -> Tuple[int, int]:
+        """
+        Insert buffered tick chunks in batches of at most batch_size
+        
+        A failed batch is counted and skipped so the remaining batches are still inserted
+        
+        Returns:
+            Tuple of (ticks inserted, batches failed)
+        """
+        df = pd.concat(chunks, ignore_index=True)
+        inserted = 0
+        failed = 0
+        for start in range(0, len(df), self.batch_size):
+            try:
+                inserted += self.insert_batch(df.iloc[start:start + self.batch_size], symbol)
+            except Exception:
+                # insert_batch has already logged the failure
+                failed += 1
+        return inserted, failed
+    
+    def _fetch_ticks(self, symbol: str, dl: Dict, from_ms: int, to_ms: int, tick_queue: Queue) -> int:
+        """
+        Download, parse and filter one planned file, queueing its ticks for the DB writer
+        
+        Returns:
+            Number of ticks queued
+        """
+        data, date, hour = self.download_bi5_file(dl['url'], dl['date'], dl['hour'])
+        return self._queue_ticks(data, symbol, dl, from_ms, to_ms, tick_queue)
+    
+    def _queue_ticks(self, data: Optional[bytes], symbol: str, dl: Dict, from_ms: int,
+                     to_ms: int, tick_queue: Queue) -> int:
+        """
+        Parse and filter one decompressed file, queueing its ticks for the DB writer
+        
+        Returns:
+            Number of ticks queued
+        """
+        if not data:
+            return 0
+        
+        # Parse ticks - base time is always the date (at 00:00)
+        base_time = dl['date'].replace(hour=0) if dl['daily'] else dl['date']
+        ticks = self.parse_bi5_data(data, symbol, base_time)
+        
+        # Filter ticks to only include those within our time range; files planned
+        # entirely inside the range need no filtering
+        if not dl['fully_inside'] and not ticks.empty:
+            ticks = ticks[(ticks['time'] >= from_ms) & (ticks['time'] <= to_ms)]
+        if ticks.empty:
+            return 0
+        
+        tick_queue.put(ticks)
+        return len(ticks)
+    
+    def _writer_loop(self, tick_queue: Queue, symbol: str, stats: Dict[str, int], stats_lock: Lock):
+        """Consume tick chunks from the queue and insert them in batches until a None sentinel"""
+        tick_chunks: List[pd.DataFrame] = []
+        row_count = 0
+        inserted = 0
+        failed = 0
+        
+        while True:
+            chunk = tick_queue.get()
+            if chunk is None:
+                break
+            if self.shutdown:
+                # Keep draining so workers never block on a full queue
+                continue
+            
+            tick_chunks.append(chunk)
+            row_count += len(chunk)
+            
+            # Insert batch if buffer is full
+            if row_count >= self.batch_size:
+                to_flush, tick_chunks, row_count = tick_chunks, [], 0
+                # Failed batches are counted rather than raised so we keep consuming
+                batch_inserted, batch_failed = self._flush_chunks(to_flush, symbol)
+                inserted += batch_inserted
+                failed += batch_failed
+        
+        # Insert remaining ticks
+        if row_count > 0 and not self.shutdown:
+            batch_inserted, batch_failed = self._flush_chunks(tick_chunks, symbol)
+            inserted += batch_inserted
+            failed += batch_failed
+        
+        with stats_lock:
+            stats['ticks_inserted'] += inserted
+            stats['failed_batches'] += failed
+    
+    def _download_all(self, symbol: str, downloads: List[Dict], from_ms: int, to_ms: int,
+                      tick_queue: Queue, progress: ProgressReporter, stats: Dict[str, int]):
+        """Download planned files on a thread pool, queueing parsed ticks for the DB writers"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Submit all download tasks
+            future_to_download = {
+                executor.submit(
+                    self._fetch_ticks,
+                    symbol,
+                    dl,
+                    from_ms,
+                    to_ms,
+                    tick_queue
+                ): dl
+                for dl in downloads
+            }
+            
+            # Track completed downloads
+            for future in as_completed(future_to_download):
+                if self.shutdown:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                    
+                dl_info = future_to_download[future]
+                
+                try:
+                    tick_count = future.result()
+                    progress.update(hours=dl_info['expected_hours'], ticks=tick_count)
+                except Exception as e:
+                    self.logger.error(f"Failed to process {dl_info}: {e}")
+                    progress.update(failed_hour=f"{dl_info['date'].isoformat()}")
+                
+                stats['hours_processed'] += dl_info['expected_hours']
+    
+    async def _download_all_async(self, symbol: str, downloads: List[Dict], from_ms: int,
+                                  to_ms: int, tick_queue: Queue, progress: ProgressReporter,
+                                  stats: Dict[str, int]):
+        """Download planned files over one multiplexed HTTP/2 connection, queueing parsed ticks for the DB writers"""
+        import httpx  # Optional dependency, only needed with --http2
+        
+        semaphore = asyncio.Semaphore(self.max_workers)
+        limits = httpx.Limits(max_connections=self.max_workers, max_keepalive_connections=self.max_workers)
+        
+        def process(raw: bytes, dl: Dict) -> int:
+            # Runs in a worker thread so decompression and parsing never block the event loop.
+            # Empty 200 responses mean no ticks for the period (weekends, holidays)
+            if not raw:
+                return 0
+            return self._queue_ticks(lzma.decompress(raw), symbol, dl, from_ms, to_ms, tick_queue)
+        
+        async def fetch(client: 'httpx.AsyncClient', dl: Dict):
+            try:
+                async with semaphore:
+                    if self.shutdown:
+                        return
+                    url = dl['url']
+                    
+                    # Retry transport errors and transient statuses with exponential backoff,
+                    # matching the urllib3 path
+                    for attempt in range(4):
+                        try:
+                            response = await client.get(url)
+                        except httpx.TransportError:
+                            if attempt == 3:
+                                raise
+                        else:
+                            if response.status_code not in RETRY_STATUSES or attempt == 3:
+                                break
+                        await asyncio.sleep(2 ** attempt)
+                    
+                    tick_count = 0
+                    if response.status_code == 404:
+                        self.logger.debug(f"No data available for {symbol} at {url}")
+                    else:
+                        response.raise_for_status()
+                        tick_count = await asyncio.to_thread(process, response.content, dl)
+                progress.update(hours=dl['expected_hours'], ticks=tick_count)
+            except Exception as e:
+                self.logger.error(f"Failed to process {dl}: {e}")
+                progress.update(failed_hour=f"{dl['date'].isoformat()}")
+            
+            stats['hours_processed'] += dl['expected_hours']
+        
+        async with httpx.AsyncClient(http2=True, limits=limits, timeout=30.0) as client:
+            await asyncio.gather(*(fetch(client, dl) for dl in downloads))
+    
+    def refresh_aggregates(self, symbol: str, from_time: datetime, to_time: datetime):
+        """Run cascade_forex_aggregate_refresh over the range, in weekly chunks for large ranges"""
+        try:
+            with self.engine.begin() as conn:
+                # For large imports, do batched refresh (weekly chunks)
+                if (to_time - from_time).days > 7:
+                    current = from_time
+                    while current < to_time:
+                        next_refresh = min(current + timedelta(days=7), to_time)
+                        conn.execute(text("""
+                            SELECT cascade_forex_aggregate_refresh(:symbol, :start_time::timestamptz)
+                        """), {'symbol': symbol, 'start_time': current})
+                        self.logger.info(f"Triggered cascade refresh for {symbol} from {current}")
+                        current = next_refresh
+                else:
+                    conn.execute(text("""
+                        SELECT cascade_forex_aggregate_refresh(:symbol, :start_time::timestamptz)
+                    """), {'symbol': symbol, 'start_time': from_time})
+                    self.logger.info(f"Triggered cascade refresh for {symbol}")
+                    
+        except Exception as e:
+            self.logger.error(f"Failed to trigger cascade refresh for {symbol}: {e}")
+    
+    def _launch_background_refresh(self, symbol: str, from_time: datetime, to_time: datetime):
+        """Re-run this script in --refresh-only mode as a detached process"""
+        try:
+            # Detach from the caller's pipes (the Rust side waits for them to close) but keep
+            # the child's logs in a file; Popen duplicates the handle, so ours can be closed
+            with open(REFRESH_LOG_PATH, 'ab') as log_file:
+                subprocess.Popen(
+                    [
+                        sys.executable, os.path.abspath(__file__),
+                        '--symbol', symbol,
+                        '--from', from_time.isoformat(),
+                        '--to', to_time.isoformat(),
+                        '--refresh-only'
+                    ],
+                    # Pass the DB URL via the environment rather than the visible command line
+                    env={**os.environ, 'DATABASE_URL': self.db_url},
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=log_file,
+                    start_new_session=True
+                )
+            self.logger.info(f"Launched background cascade refresh for {symbol} (log: {REFRESH_LOG_PATH})")
+        except OSError as e:
+            # Fall back to refreshing inline
+            self.logger.warning(f"Could not launch background cascade refresh ({e}), running inline")
+            self.refresh_aggregates(symbol, from_time, to_time)
+    
     def catchup_gap(self, symbol: str, from_time: datetime, to_time: datetime) -> Dict[str, int]:
         """
         Fill data gap for a specific symbol and time range using concurrent downloads
         Intelligently uses daily files when fetching full days to reduce requests by 24x
         
         Returns:
-            Dict with statistics: {'ticks_inserted': n, 'hours_processed': n}
+            Dict with statistics: {'ticks_inserted': n, 'hours_processed': n, 'failed_batches': n}
         """
-        stats = {'ticks_inserted': 0, 'hours_processed': 0}
+        stats = {'ticks_inserted': 0, 'hours_processed': 0, 'failed_batches': 0}
         
         # Ensure we're working with UTC
         if from_time.tzinfo is None:
@@ -305,8 +635,10 @@ class CatchupIngester:
         
         self.logger.info(f"Starting catchup for {symbol} from {from_time} to {to_time}")
         
-        # Smart download planning: use daily files for full days, hourly for partial
+        # Smart download planning: use daily files for full days, hourly for partial.
+        # URLs are built here once so workers only have to fetch them
         downloads_to_fetch = []
+        symbol_url = f"{self.base_url}/{symbol.upper()}"
         current = from_time.replace(minute=0, second=0, microsecond=0)
         
         while current <= to_time:
@@ -316,22 +648,27 @@ class CatchupIngester:
             
             # If current is at start of day AND we need the whole day
             if current == day_start and day_end <= to_time:
-                # Fetch daily file (24x fewer requests!)
+                # Fetch daily file (24x fewer requests!): /{year}/{month-1}/{day}_ticks.bi5
                 downloads_to_fetch.append({
+                    'url': f"{symbol_url}/{current.year}/{current.month-1:02d}/{current.day:02d}_ticks.bi5",
                     'date': current,
                     'hour': None,
                     'daily': True,
-                    'expected_hours': 24
+                    'expected_hours': 24,
+                    'fully_inside': from_time <= day_start and day_start + timedelta(days=1) - timedelta(milliseconds=1) <= to_time
                 })
                 current = day_start + timedelta(days=1)
                 self.logger.info(f"Using daily file for {day_start.date()}")
             else:
-                # Fetch hourly file
+                # Fetch hourly file: /{year}/{month-1}/{day}/{hour}h_ticks.bi5
+                hour_end = current + timedelta(hours=1) - timedelta(milliseconds=1)
                 downloads_to_fetch.append({
+                    'url': f"{symbol_url}/{current.year}/{current.month-1:02d}/{current.day:02d}/{current.hour:02d}h_ticks.bi5",
                     'date': current,
                     'hour': current.hour,
                     'daily': False,
-                    'expected_hours': 1
+                    'expected_hours': 1,
+                    'fully_inside': from_time <= current and hour_end <= to_time
                 })
                 current += timedelta(hours=1)
         
@@ -341,98 +678,43 @@ class CatchupIngester:
         
         self.logger.info(f"Fetching {len(downloads_to_fetch)} files ({total_hours} hours of data)")
         
-        # Process downloads concurrently
-        tick_buffer = []
+        # Workers download, parse and filter files, handing DataFrame chunks to a pool of
+        # DB writer threads; the bounded queue keeps both sides busy while capping memory.
+        # Each writer upserts on its own pooled connection (temp tables are per-session)
+        tick_queue: Queue = Queue(maxsize=2 * self.max_workers)
+        stats_lock = Lock()
+        writers = [
+            Thread(target=self._writer_loop, args=(tick_queue, symbol, stats, stats_lock),
+                   name=f"catchup-db-writer-{i}")
+            for i in range(self.db_writers)
+        ]
+        for writer in writers:
+            writer.start()
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all download tasks
-            future_to_download = {
-                executor.submit(
-                    self.download_bi5_file, 
-                    symbol, 
-                    dl['date'], 
-                    dl['hour'],
-                    dl['daily']
-                ): dl
-                for dl in downloads_to_fetch
-            }
-            
-            # Process completed downloads
-            for future in as_completed(future_to_download):
-                if self.shutdown:
-                    executor.shutdown(wait=False)
-                    break
-                    
-                dl_info = future_to_download[future]
-                
-                try:
-                    compressed_data, date, hour = future.result()
-                    
-                    if compressed_data:
-                        # Parse ticks - base time is always the date (at 00:00)
-                        base_time = date.replace(hour=0) if dl_info['daily'] else date
-                        ticks = self.parse_bi5_data(
-                            compressed_data, 
-                            symbol, 
-                            base_time
-                        )
-                        
-                        # Filter ticks to only include those within our time range
-                        filtered_ticks = [
-                            tick for tick in ticks 
-                            if from_time <= tick['time'] <= to_time
-                        ]
-                        
-                        if filtered_ticks:
-                            tick_buffer.extend(filtered_ticks)
-                            progress.update(hours=dl_info['expected_hours'], ticks=len(filtered_ticks))
-                        else:
-                            progress.update(hours=dl_info['expected_hours'])
-                    else:
-                        progress.update(hours=dl_info['expected_hours'])
-                    
-                    # Insert batch if buffer is full
-                    if len(tick_buffer) >= self.batch_size:
-                        inserted = self.insert_batch(tick_buffer[:self.batch_size])
-                        stats['ticks_inserted'] += inserted
-                        tick_buffer = tick_buffer[self.batch_size:]
-                        
-                except Exception as e:
-                    self.logger.error(f"Failed to process {dl_info}: {e}")
-                    progress.update(failed_hour=f"{date.isoformat()}")
-                
-                stats['hours_processed'] += dl_info['expected_hours']
+        # Ticks are filtered on integer epoch-ms times; round the start up to stay inclusive
+        from_ms = epoch_ms(from_time, round_up=True)
+        to_ms = epoch_ms(to_time)
         
-        # Insert remaining ticks
-        if tick_buffer and not self.shutdown:
-            inserted = self.insert_batch(tick_buffer)
-            stats['ticks_inserted'] += inserted
+        try:
+            if self.http2:
+                asyncio.run(self._download_all_async(
+                    symbol, downloads_to_fetch, from_ms, to_ms, tick_queue, progress, stats
+                ))
+            else:
+                self._download_all(symbol, downloads_to_fetch, from_ms, to_ms, tick_queue, progress, stats)
+        finally:
+            # Signal each writer to flush what it has buffered and stop
+            for _ in writers:
+                tick_queue.put(None)
+            for writer in writers:
+                writer.join()
         
-        # Trigger cascade refresh after catchup (if not interrupted)
+        # Hand the cascade refresh to a detached process so we return as soon as data is committed
         if not self.shutdown and stats['ticks_inserted'] > 0:
-            try:
-                with self.engine.begin() as conn:
-                    # For large imports, do batched refresh (weekly chunks)
-                    if (to_time - from_time).days > 7:
-                        current = from_time
-                        while current < to_time:
-                            next_refresh = min(current + timedelta(days=7), to_time)
-                            conn.execute(text("""
-                                SELECT cascade_forex_aggregate_refresh(:symbol, :start_time::timestamptz)
-                            """), {'symbol': symbol, 'start_time': current})
-                            current = next_refresh
-                            self.logger.info(f"Triggered cascade refresh for {symbol} from {current}")
-                    else:
-                        conn.execute(text("""
-                            SELECT cascade_forex_aggregate_refresh(:symbol, :start_time::timestamptz)
-                        """), {'symbol': symbol, 'start_time': from_time})
-                        self.logger.info(f"Triggered cascade refresh for {symbol}")
-                        
-            except Exception as e:
-                self.logger.error(f"Failed to trigger cascade refresh: {e}")
+            self._launch_background_refresh(symbol, from_time, to_time)
         
         # Final progress report
-        progress.final_report(stats['ticks_inserted'])
+        progress.final_report(stats['ticks_inserted'], stats['failed_batches'])
         
         return stats
 
@@ -487,8 +769,24 @@ def main():
     parser.add_argument(
         '--batch-size',
         type=int,
-        default=1_000_000,
-        help='Number of ticks per database batch (default: 1000000)'
+        default=10_000,
+        help='Number of ticks per database batch (default: 10000)'
+    )
+    parser.add_argument(
+        '--db-writers',
+        type=int,
+        default=4,
+        help='Number of concurrent database writer threads (default: 4)'
+    )
+    parser.add_argument(
+        '--http2',
+        action='store_true',
+        help='Download over multiplexed HTTP/2 (requires httpx[http2])'
+    )
+    parser.add_argument(
+        '--refresh-only',
+        action='store_true',
+        help='Only run the cascade aggregate refresh for the range (used for background refreshes)'
     )
     
     args = parser.parse_args()
@@ -523,12 +821,18 @@ def main():
     ingester = CatchupIngester(
         args.db_url,
         max_workers=args.workers,
-        batch_size=args.batch_size
+        batch_size=args.batch_size,
+        db_writers=args.db_writers,
+        http2=args.http2
     )
     
+    if args.refresh_only:
+        ingester.refresh_aggregates(args.symbol, from_time, to_time)
+        sys.exit(0)
+    
     try:
         stats = ingester.catchup_gap(args.symbol, from_time, to_time)
-        sys.exit(0 if stats['ticks_inserted'] > 0 else 1)
+        sys.exit(0 if stats['ticks_inserted'] > 0 and stats['failed_batches'] == 0 else 1)
     except Exception as e:
         error_msg = {"type": "error", "message": f"Catchup failed: {str(e)}"}
         print(json.dumps(error_msg), flush=True)